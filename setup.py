@@ -5,5 +5,6 @@ setup(
     version="0.1.0",
     packages=find_packages(where="src"),
     package_dir={"": "src"},
+    python_requires=">=3.10",
     install_requires=["fastapi", "uvicorn"],
 )
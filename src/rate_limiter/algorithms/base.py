@@ -1,12 +1,12 @@
 from abc import ABC, abstractmethod
 from typing import Dict, Any
 from ..core.request import RateLimitRequest
-from ..core.response import RateLimitResponse
+from ..core.response import RateLimitResult
 
 
 class RateLimitingAlgorithm(ABC):
     @abstractmethod
-    async def allow_request(self, request: RateLimitRequest) -> RateLimitResponse:
+    async def allow_request(self, request: RateLimitRequest) -> RateLimitResult:
         pass
 
     @abstractmethod
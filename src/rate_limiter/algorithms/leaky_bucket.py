@@ -1,11 +1,10 @@
-import asyncio
 from collections import deque
-from time import time
-from typing import Dict, Any, Optional
+from time import monotonic_ns, time
+from typing import Dict, Any
 
 from src.rate_limiter.algorithms.base import RateLimitingAlgorithm
 from src.rate_limiter.core.request import RateLimitRequest
-from src.rate_limiter.core.response import RateLimitResponse
+from src.rate_limiter.core.response import RateLimitResult
 
 
 class LeakyBucketAlgorithm(RateLimitingAlgorithm):
@@ -20,44 +19,50 @@ class LeakyBucketAlgorithm(RateLimitingAlgorithm):
         self.bucket_size = bucket_size
         self.leak_rate = leak_rate
         self.processing_interval = 1.0 / leak_rate
-
-        self.bucket: deque = deque(maxlen=bucket_size)
-        self.lock = asyncio.Lock()
+        self._interval_ns = max(int(1e9 / leak_rate), 1)
+        self._limit_header = (b"x-ratelimit-limit", str(bucket_size).encode())
+        self._accept_headers = [
+            (self._limit_header, (b"x-ratelimit-remaining", b"%d" % (bucket_size - i - 1)))
+            for i in range(bucket_size)
+        ]
+        self._reset_offset_table = [
+            (i + 1) * self.processing_interval for i in range(bucket_size)
+        ]
+        self._retry_after = int(bucket_size * self.processing_interval)
+        self._reject_headers = (
+            self._limit_header,
+            (b"x-ratelimit-remaining", b"0"),
+        )
+        self._retry_after_header = (b"retry-after", b"%d" % self._retry_after)
+
+        self.bucket: deque = deque()
+        self._size = 0
 
         self.total_requests = 0
         self.accepted_requests = 0
         self.rejected_requests = 0
-        self.last_leak_time = time()
-        self.processing_times: deque = deque(maxlen=1000)
-
-        self.leak_task: Optional[asyncio.Task] = None
-
-    async def start(self):
-        """Start the background leaking process"""
-        if self.leak_task is None:
-            self.leak_task = asyncio.create_task(self._leak_bucket())
-
-    async def stop(self):
-        """Stop the background leaking process"""
-        if self.leak_task:
-            self.leak_task.cancel()
-            try:
-                await self.leak_task
-            except asyncio.CancelledError:
-                pass
-            self.leak_task = None
-
-    async def _leak_bucket(self):
-        """Background task that processes requests at the specified rate"""
-        while True:
-            await asyncio.sleep(self.processing_interval)
-            async with self.lock:
-                if self.bucket:
-                    request = self.bucket.popleft()
-                    process_time = time() - request.timestamp
-                    self.processing_times.append(process_time)
-
-    async def allow_request(self, request: RateLimitRequest) -> RateLimitResponse:
+        self._last_leak_ns = monotonic_ns()
+        self._avg_process_time: float = 0.0
+        self._ewma_beta = 0.05
+        self._leaked = 0
+
+    def _leak(self, now_ns: int):
+        """Drain the requests that would have been processed since the last leak"""
+        leaked = (now_ns - self._last_leak_ns) // self._interval_ns
+        if leaked:
+            drained = min(leaked, self._size)
+            for i in range(drained):
+                arrival_ns = self.bucket.popleft()
+                leak_ns = self._last_leak_ns + (i + 1) * self._interval_ns
+                process_time = (leak_ns - arrival_ns) / 1e9
+                self._avg_process_time += self._ewma_beta * (
+                    process_time - self._avg_process_time
+                )
+            self._size -= drained
+            self._leaked += drained
+            self._last_leak_ns += leaked * self._interval_ns
+
+    async def allow_request(self, request: RateLimitRequest) -> RateLimitResult:
         """
         Determine if a new request should be allowed based on current bucket state
 
@@ -65,44 +70,37 @@ class LeakyBucketAlgorithm(RateLimitingAlgorithm):
             request: The incoming rate limit request
 
         Returns:
-            RateLimitResponse indicating if request is allowed and relevant headers
+            Tuple of (is_allowed, encoded headers, retry_after)
         """
         self.total_requests += 1
-        current_time = time()
-
-        async with self.lock:
-            current_size = len(self.bucket)
-
-            if current_size < self.bucket_size:
-                self.bucket.append(request)
-                self.accepted_requests += 1
-
-                headers = {
-                    "X-RateLimit-Limit": str(self.bucket_size),
-                    "X-RateLimit-Remaining": str(self.bucket_size - current_size - 1),
-                    "X-RateLimit-Reset": str(
-                        int(
-                            current_time + (current_size + 1) * self.processing_interval
-                        )
-                    ),
-                }
-
-                return RateLimitResponse(is_allowed=True, headers=headers)
-            else:
-                self.rejected_requests += 1
-
-                retry_after = int(current_size * self.processing_interval)
-
-                headers = {
-                    "X-RateLimit-Limit": str(self.bucket_size),
-                    "X-RateLimit-Remaining": "0",
-                    "X-RateLimit-Reset": str(int(current_time + retry_after)),
-                    "Retry-After": str(retry_after),
-                }
-
-                return RateLimitResponse(
-                    is_allowed=False, headers=headers, retry_after=retry_after
-                )
+        now_ns = monotonic_ns()
+        self._leak(now_ns)
+        current_size = self._size
+
+        if current_size < self.bucket_size:
+            self.bucket.append(now_ns)
+            self._size = current_size + 1
+            self.accepted_requests += 1
+
+            reset = int(time() + self._reset_offset_table[current_size])
+            headers = [
+                *self._accept_headers[current_size],
+                (b"x-ratelimit-reset", b"%d" % reset),
+            ]
+
+            return True, headers, None
+        else:
+            self.rejected_requests += 1
+
+            retry_after = self._retry_after
+
+            headers = [
+                *self._reject_headers,
+                (b"x-ratelimit-reset", b"%d" % (int(time()) + retry_after)),
+                self._retry_after_header,
+            ]
+
+            return False, headers, retry_after
 
     async def get_status(self) -> Dict[str, Any]:
         """
@@ -111,33 +109,33 @@ class LeakyBucketAlgorithm(RateLimitingAlgorithm):
         Returns:
             Dictionary containing current status and performance metrics
         """
-        async with self.lock:
-            current_size = len(self.bucket)
-            avg_processing_time = (
-                sum(self.processing_times) / len(self.processing_times)
-                if self.processing_times
-                else 0
-            )
-
-            return {
-                "config": {
-                    "bucket_size": self.bucket_size,
-                    "leak_rate": self.leak_rate,
-                    "processing_interval": self.processing_interval,
-                },
-                "current_state": {
-                    "current_size": current_size,
-                    "utilization": current_size / self.bucket_size,
-                },
-                "metrics": {
-                    "total_requests": self.total_requests,
-                    "accepted_requests": self.accepted_requests,
-                    "rejected_requests": self.rejected_requests,
-                    "acceptance_rate": (
-                        self.accepted_requests / self.total_requests
-                        if self.total_requests > 0
-                        else 0
-                    ),
-                    "avg_processing_time": avg_processing_time,
-                },
-            }
+        self._leak(monotonic_ns())
+        current_size = self._size
+        avg_processing_time = (
+            self._avg_process_time / (1 - (1 - self._ewma_beta) ** self._leaked)
+            if self._leaked
+            else 0
+        )
+
+        return {
+            "config": {
+                "bucket_size": self.bucket_size,
+                "leak_rate": self.leak_rate,
+                "processing_interval": self.processing_interval,
+            },
+            "current_state": {
+                "current_size": current_size,
+                "utilization": current_size / self.bucket_size,
+            },
+            "metrics": {
+                "total_requests": self.total_requests,
+                "accepted_requests": self.accepted_requests,
+                "rejected_requests": self.rejected_requests,
+                "acceptance_rate": (
+                    self.accepted_requests / self.total_requests
+                    if self.total_requests > 0
+                    else 0
+                ),
+                "avg_processing_time": avg_processing_time,
+            },
+        }
@@ -1,12 +1,19 @@
 from dataclasses import dataclass
-from typing import Dict, Any
+from typing import Dict, Any, Optional, Union
 
 
-@dataclass
+@dataclass(slots=True)
 class RateLimitRequest:
-    id: str
-    timestamp: float
+    """
+    A request to be checked by a rate limiting algorithm
+
+    `timestamp` is an informational wall-clock arrival time. Algorithms keep
+    their own clock for rate calculations, so the middleware passes None.
+    """
+
+    id: Union[str, bytes]
+    timestamp: Optional[float]
     client_ip: str
     path: str
     method: str
-    metadata: Dict[str, Any] = None
+    metadata: Optional[Dict[str, Any]] = None
@@ -1,13 +1,18 @@
-from typing import Dict, Optional
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
 
+# (is_allowed, encoded headers, retry_after) as returned by RateLimitingAlgorithm.allow_request
+RateLimitResult = Tuple[bool, Sequence[Tuple[bytes, bytes]], Optional[int]]
 
+
+@dataclass(slots=True)
 class RateLimitResponse:
-    def __init__(
-        self,
-        is_allowed: bool,
-        headers: Dict[str, str] = None,
-        retry_after: Optional[int] = None,
-    ):
-        self.is_allowed = is_allowed
-        self.headers = headers or {}
-        self.retry_after = retry_after
+    is_allowed: bool
+    headers: List[Tuple[bytes, bytes]] = field(default_factory=list)
+    retry_after: Optional[int] = None
+
+    @classmethod
+    def from_result(cls, result: RateLimitResult) -> "RateLimitResponse":
+        """Wrap a raw allow_request result for callers that prefer named fields"""
+        is_allowed, headers, retry_after = result
+        return cls(is_allowed, list(headers), retry_after)
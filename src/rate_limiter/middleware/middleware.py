@@ -1,141 +1,151 @@
-import asyncio
-from functools import wraps
-from time import time
-from typing import Dict, Any, Callable
+import json
+from functools import lru_cache
+from typing import Dict, Any, Callable, Optional, Sequence, Tuple, Union
 
-from fastapi import FastAPI, Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse
+from fastapi import HTTPException, Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from ..algorithms.base import RateLimitingAlgorithm
 from ..core.request import RateLimitRequest
 
 
-class HTTPRateLimiter(BaseHTTPMiddleware):
-    """FastAPI middleware for rate limiting"""
+@lru_cache(maxsize=4096)
+def _make_id(host: str, path: str) -> bytes:
+    """Build the bytes identifier for a client/path pair, cached for repeat clients"""
+    return host.encode() + b":" + path.encode()
+
+
+class HTTPRateLimiter:
+    """Pure ASGI middleware for rate limiting"""
 
     def __init__(
         self,
-        app: FastAPI,
+        app: ASGIApp,
         algorithm: RateLimitingAlgorithm,
         status_code: int = 429,
         error_message: str = "Too Many Requests",
+        metadata_extractor: Optional[Callable[[Scope], Dict[str, Any]]] = None,
     ):
-        super().__init__(app)
+        if algorithm is None:
+            raise ValueError("HTTPRateLimiter requires a rate limiting algorithm")
+
+        self.app = app
         self.algorithm = algorithm
         self.status_code = status_code
         self.error_message = error_message
-        self.stats = {
-            "total_requests": 0,
-            "allowed_requests": 0,
-            "rejected_requests": 0,
-        }
-        self._lock = asyncio.Lock()
-
-    def get_request_identifier(self, request: Request) -> str:
+        self.metadata_extractor = metadata_extractor
+        self._reject_body = json.dumps({"error": error_message}).encode("utf-8")
+        self._reject_headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", b"%d" % len(self._reject_body)),
+        ]
+        self.total_requests = 0
+        self.allowed_requests = 0
+        self.rejected_requests = 0
+
+    def get_request_identifier(self, scope: Scope) -> Union[str, bytes]:
         """
         Generate a unique identifier for the request.
         Override this method to customize how requests are identified.
         """
-        return f"{request.client.host}:{request.url.path}"
+        return _make_id(scope["client"][0], scope["path"])
+
+    def _encoded_headers_for(
+        self, headers: Sequence[Tuple[bytes, bytes]]
+    ) -> Sequence[Tuple[bytes, bytes]]:
+        """Rate limit headers to add to the response, in ASGI (bytes, bytes) form"""
+        return headers
 
     async def get_stats(self) -> Dict[str, Any]:
         """Get rate limiter statistics"""
-        async with self._lock:
-            return {**self.stats, "algorithm_status": await self.algorithm.get_status()}
+        return {
+            "total_requests": self.total_requests,
+            "allowed_requests": self.allowed_requests,
+            "rejected_requests": self.rejected_requests,
+            "algorithm_status": await self.algorithm.get_status(),
+        }
 
-    async def dispatch(self, request: Request, call_next: Callable) -> Response:
-        """Process each request through the rate limiter"""
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Process each HTTP request through the rate limiter"""
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-        # Create rate limit request object
+        # Create rate limit request object straight from the scope
         rate_limit_request = RateLimitRequest(
-            id=self.get_request_identifier(request),
-            timestamp=time(),
-            client_ip=request.client.host,
-            path=request.url.path,
-            method=request.method,
-            metadata={
-                "headers": dict(request.headers),
-                "query_params": dict(request.query_params),
-            },
+            id=self.get_request_identifier(scope),
+            timestamp=None,
+            client_ip=scope["client"][0],
+            path=scope["path"],
+            method=scope["method"],
+            metadata=self.metadata_extractor(scope) if self.metadata_extractor else None,
         )
 
         # Update stats
-        async with self._lock:
-            self.stats["total_requests"] += 1
+        self.total_requests += 1
 
         # Check if request is allowed
-        rate_limit_response = await self.algorithm.allow_request(rate_limit_request)
+        is_allowed, headers, _ = await self.algorithm.allow_request(rate_limit_request)
 
-        if rate_limit_response.is_allowed:
+        if is_allowed:
             # Update stats
-            async with self._lock:
-                self.stats["allowed_requests"] += 1
+            self.allowed_requests += 1
 
-            # Process the request
-            response = await call_next(request)
+            rate_limit_headers = self._encoded_headers_for(headers)
 
-            # Add rate limit headers to response
-            for header, value in rate_limit_response.headers.items():
-                response.headers[header] = str(value)
+            async def send_wrapper(message: Message) -> None:
+                # Add rate limit headers to the outgoing response
+                if message["type"] == "http.response.start":
+                    message["headers"] = [*message.get("headers", ()), *rate_limit_headers]
+                await send(message)
 
-            return response
+            # Process the request
+            await self.app(scope, receive, send_wrapper)
         else:
             # Update stats
-            async with self._lock:
-                self.stats["rejected_requests"] += 1
-
-            # Create error response
-            headers = rate_limit_response.headers
-            if rate_limit_response.retry_after:
-                headers["Retry-After"] = str(rate_limit_response.retry_after)
-
-            return JSONResponse(
-                status_code=self.status_code,
-                content={"error": self.error_message},
-                headers=headers,
+            self.rejected_requests += 1
+
+            # Send the prebuilt error response
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": [
+                        *self._encoded_headers_for(headers),
+                        *self._reject_headers,
+                    ],
+                }
             )
+            await send({"type": "http.response.body", "body": self._reject_body})
 
 
-def rate_limit(algorithm: RateLimitingAlgorithm):
+def rate_limit_dependency(algorithm: RateLimitingAlgorithm) -> Callable:
     """
-    Decorator for rate limiting individual endpoints
+    FastAPI dependency for rate limiting individual endpoints
     Usage:
-        @app.get("/")
-        @rate_limit(your_algorithm)
+        @app.get("/", dependencies=[Depends(rate_limit_dependency(your_algorithm))])
         async def endpoint():
             return {"message": "Hello World"}
     """
 
-    def decorator(func: Callable) -> Callable:
-        @wraps(func)
-        async def wrapper(*args, **kwargs):
-            request = kwargs.get("request") or args[0]
-            if not isinstance(request, Request):
-                raise ValueError("No request object found")
-
-            rate_limit_request = RateLimitRequest(
-                id=str(request.client.host),
-                timestamp=time(),
-                client_ip=request.client.host,
-                path=request.url.path,
-                method=request.method,
-            )
-
-            response = await algorithm.allow_request(rate_limit_request)
-            if not response.is_allowed:
-                headers = response.headers
-                if response.retry_after:
-                    headers["Retry-After"] = str(response.retry_after)
-
-                return JSONResponse(
-                    status_code=429,
-                    content={"error": "Too Many Requests"},
-                    headers=headers,
-                )
-
-            return await func(*args, **kwargs)
+    async def dependency(request: Request) -> None:
+        rate_limit_request = RateLimitRequest(
+            id=request.client.host,
+            timestamp=None,
+            client_ip=request.client.host,
+            path=request.url.path,
+            method=request.method,
+        )
 
-        return wrapper
+        is_allowed, headers, _ = await algorithm.allow_request(rate_limit_request)
+        if not is_allowed:
+            raise HTTPException(
+                status_code=429,
+                detail="Too Many Requests",
+                headers={
+                    name.decode("latin-1"): value.decode("latin-1")
+                    for name, value in headers
+                },
+            )
 
-    return decorator
+    return dependency
@@ -1,30 +1,23 @@
 import asyncio
-from contextlib import asynccontextmanager
 from time import time
 
 import pytest
 import pytest_asyncio
 import respx
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from httpx import ASGITransport
 from httpx import AsyncClient
 
 from rate_limiter.algorithms.leaky_bucket import LeakyBucketAlgorithm
 from rate_limiter.core.request import RateLimitRequest
-from rate_limiter.middleware.middleware import HTTPRateLimiter
-
-
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    await app.state.limiter.start()
-    yield
-    await app.state.limiter.stop()
+from rate_limiter.core.response import RateLimitResponse
+from rate_limiter.middleware.middleware import HTTPRateLimiter, rate_limit_dependency
 
 
 @pytest_asyncio.fixture
 async def app():
     """Fixture for the FastAPI application."""
-    app = FastAPI(lifespan=lifespan)
+    app = FastAPI()
     app.state.limiter = LeakyBucketAlgorithm(bucket_size=5, leak_rate=1)
     app.add_middleware(HTTPRateLimiter, algorithm=app.state.limiter)
 
@@ -45,17 +38,14 @@ async def client(app):
 @pytest_asyncio.fixture
 async def leaky_bucket_algorithm():
     """Fixture for the LeakyBucketAlgorithm."""
-    algorithm = LeakyBucketAlgorithm(bucket_size=5, leak_rate=1)
-    await algorithm.start()
-    yield algorithm
-    await algorithm.stop()
+    return LeakyBucketAlgorithm(bucket_size=5, leak_rate=1)
 
 @pytest.mark.asyncio
 async def test_bucket_fills_correctly(leaky_bucket_algorithm):
     for i in range(5):
         request = RateLimitRequest(id=str(i), timestamp=time(), client_ip="127.0.0.1", path="/", method="GET")
-        response = await leaky_bucket_algorithm.allow_request(request)
-        assert response.is_allowed
+        is_allowed, _, _ = await leaky_bucket_algorithm.allow_request(request)
+        assert is_allowed
     assert len(leaky_bucket_algorithm.bucket) == 5
 
 
@@ -66,7 +56,8 @@ async def test_requests_processed_at_specified_rate(leaky_bucket_algorithm):
         await leaky_bucket_algorithm.allow_request(request)
 
     await asyncio.sleep(1.1)
-    assert len(leaky_bucket_algorithm.bucket) == 4
+    status = await leaky_bucket_algorithm.get_status()
+    assert status["current_state"]["current_size"] == 4
 
 
 @pytest.mark.asyncio
@@ -74,35 +65,51 @@ async def test_fifo_order_is_maintained(leaky_bucket_algorithm):
     for i in range(5):
         request = RateLimitRequest(id=str(i), timestamp=time(), client_ip="127.0.0.1", path="/", method="GET")
         await leaky_bucket_algorithm.allow_request(request)
+    arrivals = list(leaky_bucket_algorithm.bucket)
     await asyncio.sleep(1.1)
-    assert leaky_bucket_algorithm.bucket[0].id == "1"
+    await leaky_bucket_algorithm.get_status()
+    assert list(leaky_bucket_algorithm.bucket) == arrivals[1:]
 
 
 @pytest.mark.asyncio
 async def test_empty_bucket_behavior(leaky_bucket_algorithm):
     assert len(leaky_bucket_algorithm.bucket) == 0
     await asyncio.sleep(1.1)
-    assert len(leaky_bucket_algorithm.bucket) == 0
+    status = await leaky_bucket_algorithm.get_status()
+    assert status["current_state"]["current_size"] == 0
+
+
+@pytest.mark.asyncio
+async def test_idle_time_does_not_bank_capacity(leaky_bucket_algorithm):
+    await asyncio.sleep(2.1)
+    for i in range(5):
+        request = RateLimitRequest(id=str(i), timestamp=time(), client_ip="127.0.0.1", path="/", method="GET")
+        is_allowed, _, _ = await leaky_bucket_algorithm.allow_request(request)
+        assert is_allowed
+
+    request = RateLimitRequest(id="6", timestamp=time(), client_ip="127.0.0.1", path="/", method="GET")
+    is_allowed, _, _ = await leaky_bucket_algorithm.allow_request(request)
+    assert not is_allowed
 
 
 @pytest.mark.asyncio
 async def test_full_bucket_behavior(leaky_bucket_algorithm):
     for i in range(5):
         request = RateLimitRequest(id=str(i), timestamp=time(), client_ip="127.0.0.1", path="/", method="GET")
-        response = await leaky_bucket_algorithm.allow_request(request)
-        assert response.is_allowed
+        is_allowed, _, _ = await leaky_bucket_algorithm.allow_request(request)
+        assert is_allowed
 
     request = RateLimitRequest(id="6", timestamp=time(), client_ip="127.0.0.1", path="/", method="GET")
-    response = await leaky_bucket_algorithm.allow_request(request)
-    assert not response.is_allowed
+    is_allowed, _, _ = await leaky_bucket_algorithm.allow_request(request)
+    assert not is_allowed
 
 
 @pytest.mark.asyncio
 async def test_concurrent_request_handling(leaky_bucket_algorithm):
     requests = [RateLimitRequest(id=str(i), timestamp=time(), client_ip="127.0.0.1", path="/", method="GET") for i in range(10)]
     responses = await asyncio.gather(*[leaky_bucket_algorithm.allow_request(req) for req in requests])
-    accepted = [res for res in responses if res.is_allowed]
-    rejected = [res for res in responses if not res.is_allowed]
+    accepted = [res for res in responses if res[0]]
+    rejected = [res for res in responses if not res[0]]
     assert len(accepted) == 5
     assert len(rejected) == 5
 
@@ -114,8 +121,8 @@ async def test_rate_limit_boundary_conditions(leaky_bucket_algorithm):
         await leaky_bucket_algorithm.allow_request(request)
     await asyncio.sleep(1.1)
     request = RateLimitRequest(id="6", timestamp=time(), client_ip="127.0.0.1", path="/", method="GET")
-    response = await leaky_bucket_algorithm.allow_request(request)
-    assert response.is_allowed
+    is_allowed, _, _ = await leaky_bucket_algorithm.allow_request(request)
+    assert is_allowed
 
 
 @respx.mock
@@ -143,3 +150,151 @@ async def test_request_identification(client):
     assert "X-RateLimit-Remaining" in response2.headers
     assert response1.status_code == 200
     assert response2.status_code == 200
+
+
+@respx.mock
+@pytest.mark.asyncio
+async def test_rejected_request_response(client):
+    for _ in range(5):
+        response = await client.get("/")
+        assert response.status_code == 200
+    response = await client.get("/")
+    assert response.status_code == 429
+    assert response.json() == {"error": "Too Many Requests"}
+    assert response.headers["X-RateLimit-Limit"] == "5"
+    assert response.headers["X-RateLimit-Remaining"] == "0"
+    assert response.headers["Retry-After"] == "5"
+
+
+def test_request_identifier_is_bytes():
+    limiter = HTTPRateLimiter(app=None, algorithm=LeakyBucketAlgorithm(bucket_size=5, leak_rate=1))
+    scope = {"type": "http", "client": ("127.0.0.1", 5000), "path": "/items"}
+    assert limiter.get_request_identifier(scope) == b"127.0.0.1:/items"
+
+
+@pytest.mark.asyncio
+async def test_middleware_stats():
+    algorithm = LeakyBucketAlgorithm(bucket_size=1, leak_rate=1)
+    app = FastAPI()
+
+    @app.get("/")
+    async def root():
+        return {"message": "Hello World"}
+
+    limiter = HTTPRateLimiter(app, algorithm=algorithm)
+    async with AsyncClient(transport=ASGITransport(app=limiter), base_url="http://test") as ac:
+        await ac.get("/")
+        await ac.get("/")
+
+    stats = await limiter.get_stats()
+    assert stats["total_requests"] == 2
+    assert stats["allowed_requests"] == 1
+    assert stats["rejected_requests"] == 1
+    assert stats["algorithm_status"]["metrics"]["accepted_requests"] == 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_dependency():
+    algorithm = LeakyBucketAlgorithm(bucket_size=1, leak_rate=1)
+    app = FastAPI()
+
+    @app.get("/", dependencies=[Depends(rate_limit_dependency(algorithm))])
+    async def root():
+        return {"message": "Hello World"}
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        response1 = await ac.get("/")
+        response2 = await ac.get("/")
+
+    assert response1.status_code == 200
+    assert response2.status_code == 429
+    assert "Retry-After" in response2.headers
+
+
+def test_middleware_requires_algorithm():
+    with pytest.raises(ValueError):
+        HTTPRateLimiter(app=None, algorithm=None)
+
+
+@pytest.mark.asyncio
+async def test_result_unpacks_as_tuple(leaky_bucket_algorithm):
+    request = RateLimitRequest(id="0", timestamp=time(), client_ip="127.0.0.1", path="/", method="GET")
+    result = await leaky_bucket_algorithm.allow_request(request)
+    is_allowed, headers, retry_after = result
+    assert is_allowed
+    assert (b"x-ratelimit-limit", b"5") in headers
+    assert retry_after is None
+
+    response = RateLimitResponse.from_result(result)
+    assert response.is_allowed
+    assert response.headers == list(headers)
+
+
+@pytest.mark.asyncio
+async def test_avg_processing_time_after_drain():
+    algorithm = LeakyBucketAlgorithm(bucket_size=5, leak_rate=20)
+    for i in range(5):
+        request = RateLimitRequest(id=str(i), timestamp=time(), client_ip="127.0.0.1", path="/", method="GET")
+        await algorithm.allow_request(request)
+    await asyncio.sleep(0.3)
+    status = await algorithm.get_status()
+    assert status["current_state"]["current_size"] == 0
+    # Requests leak at 0.05s intervals, so they waited 0.05, 0.10, ... 0.25s
+    assert status["metrics"]["avg_processing_time"] == pytest.approx(0.15, abs=0.02)
+
+
+class RecordingLeakyBucketAlgorithm(LeakyBucketAlgorithm):
+    """Leaky bucket that keeps the requests it was asked about"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requests = []
+
+    async def allow_request(self, request):
+        self.requests.append(request)
+        return await super().allow_request(request)
+
+
+async def _get_through_limiter(algorithm, **kwargs):
+    app = FastAPI()
+
+    @app.get("/")
+    async def root():
+        return {"message": "Hello World"}
+
+    limiter = HTTPRateLimiter(app, algorithm=algorithm, **kwargs)
+    async with AsyncClient(transport=ASGITransport(app=limiter), base_url="http://test") as ac:
+        return await ac.get("/", params={"q": "1"})
+
+
+@pytest.mark.asyncio
+async def test_metadata_is_none_by_default():
+    algorithm = RecordingLeakyBucketAlgorithm(bucket_size=5, leak_rate=1)
+    await _get_through_limiter(algorithm)
+    assert algorithm.requests[0].metadata is None
+
+
+@pytest.mark.asyncio
+async def test_metadata_extractor():
+    algorithm = RecordingLeakyBucketAlgorithm(bucket_size=5, leak_rate=1)
+    await _get_through_limiter(
+        algorithm,
+        metadata_extractor=lambda scope: {"query_string": scope["query_string"]},
+    )
+    assert algorithm.requests[0].metadata == {"query_string": b"q=1"}
+
+
+@pytest.mark.asyncio
+async def test_non_http_scope_is_forwarded():
+    seen_scopes = []
+
+    async def inner_app(scope, receive, send):
+        seen_scopes.append(scope["type"])
+
+    limiter = HTTPRateLimiter(inner_app, algorithm=LeakyBucketAlgorithm(bucket_size=5, leak_rate=1))
+    await limiter({"type": "lifespan"}, None, None)
+    await limiter({"type": "websocket", "client": ("127.0.0.1", 5000), "path": "/ws"}, None, None)
+
+    assert seen_scopes == ["lifespan", "websocket"]
+    assert limiter.total_requests == 0
+    assert limiter.algorithm.total_requests == 0